@@ -1,20 +1,59 @@
-import clr
+import io
 import os
+import sys
 import time
 import json
-from typing import List, Dict
+import atexit
+import threading
+import numpy as np
+from typing import Callable, List, Dict, Tuple
 from dataclasses import dataclass
 
-clr.AddReference(r"C:\Users\letic\OneDrive\Documentos\sspce\testando_pythonnet\sdk\Sdk\MccSdk.dll")
+from mcc_comum import iterar_com_prefetch, para_numpy, selecionar_top_n
 
-from BioLab.Biometrics.Mcc.Sdk import MccSdk  # type: ignore
+try:
+    import orjson
+except ImportError:  # orjson é opcional; sem ele usa o json da stdlib
+    orjson = None
+
+# O índice do MccSdk é estado global do processo: toda chamada ao SDK
+# passa por este lock.
+_SDK_LOCK = threading.RLock()
+
+# Carregado sob demanda por _get_sdk(): importar este módulo não sobe o CLR
+MccSdk = None
+
+# Matcher dono do índice carregado no SDK (no máximo um por processo)
+_INDICE_ATIVO = None
+
+
+def _get_sdk():
+    """Carrega o CLR e o MccSdk na primeira chamada e devolve o SDK."""
+    global MccSdk
+    if MccSdk is None:
+        with _SDK_LOCK:
+            if MccSdk is None:
+                import clr
+                clr.AddReference(r"C:\Users\letic\OneDrive\Documentos\sspce\testando_pythonnet\sdk\Sdk\MccSdk.dll")
+                from BioLab.Biometrics.Mcc.Sdk import MccSdk as sdk  # type: ignore
+                MccSdk = sdk
+    return MccSdk
+
+
+def _liberar_indice_ativo() -> None:
+    """Libera o índice do SDK, qualquer que seja o matcher dono."""
+    global _INDICE_ATIVO
+    with _SDK_LOCK:
+        if _INDICE_ATIVO is not None:
+            _INDICE_ATIVO = None
+            MccSdk.DeleteMccIndex()
 
 
 # ============================================================================
 # DATACLASS PARA RESULTADO
 # ============================================================================
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class CandidatoSimilar:
     """Representa um candidato similar encontrado na busca."""
     id: int
@@ -24,6 +63,24 @@ class CandidatoSimilar:
     rank: int
 
 
+def _listar_templates(pasta: str) -> List[str]:
+    """Nomes dos templates .txt (qualquer caixa) da pasta, em ordem (define os template_id)."""
+    with os.scandir(pasta) as entradas:
+        return sorted(e.name for e in entradas if e.name[-4:].lower() == '.txt')
+
+
+def _candidato_json(id: int, arquivo: str, caminho_completo: str,
+                    score: float, rank: int) -> Dict:
+    """Monta o candidato direto no formato JSON, sem passar pela dataclass."""
+    return {
+        'rank': rank,
+        'id': id,
+        'arquivo': arquivo,
+        'caminho': caminho_completo,
+        'score': score
+    }
+
+
 # ============================================================================
 # CLASSE PRINCIPAL - SIMPLIFICADA
 # ============================================================================
@@ -45,9 +102,14 @@ class MccFingerprintMatcher:
             pasta_templates: Pasta contendo templates da base
             arquivo_indice: Caminho do arquivo de índice (.idx)
         """
+        _get_sdk()
+        
         self.pasta_templates = pasta_templates
         self.arquivo_indice = arquivo_indice
         self.templates_map = {}  # ID -> nome do arquivo
+        self._arquivos_array: List[str] = []  # template_id -> nome do arquivo
+        self._caminhos_array: List[str] = []  # template_id -> caminho completo
+        self._known_files = frozenset()  # caminhos da base (dispensam stat)
         
         # Parâmetros MCC (devem ser os mesmos usados na indexação)
         self.ns = 8
@@ -59,6 +121,35 @@ class MccFingerprintMatcher:
         self.deltaTheta = 3.14159 / 4.0
         self.deltaXY = 256
         self.randomSeed = 17
+        
+        atexit.register(self.liberar_indice)
+    
+    
+    def carregar_indice(self) -> None:
+        """
+        Carrega o índice do disco e o mantém residente para as buscas.
+        Chamado automaticamente na primeira busca; chame novamente após
+        recriar o arquivo .idx para recarregá-lo.
+        
+        O índice do SDK é global: carregar aqui substitui o de qualquer
+        outro matcher, que recarrega o seu na próxima busca.
+        """
+        global _INDICE_ATIVO
+        
+        if not os.path.exists(self.arquivo_indice):
+            raise FileNotFoundError(f"Índice não encontrado: {self.arquivo_indice}")
+        
+        with _SDK_LOCK:
+            _liberar_indice_ativo()
+            MccSdk.LoadMccIndexFromFile(self.arquivo_indice)
+            _INDICE_ATIVO = self
+    
+    
+    def liberar_indice(self) -> None:
+        """Libera o índice residente, se este matcher ainda for o dono."""
+        with _SDK_LOCK:
+            if _INDICE_ATIVO is self:
+                _liberar_indice_ativo()
     
     
     def criar_indice(self, verbose: bool = True) -> Dict:
@@ -72,6 +163,14 @@ class MccFingerprintMatcher:
             print("🔧 Criando índice MCC da base de templates...")
             print(f"   Pasta: {self.pasta_templates}")
         
+        with _SDK_LOCK:
+            return self._criar_indice(inicio, verbose)
+    
+    
+    def _criar_indice(self, inicio: float, verbose: bool) -> Dict:
+        # O SDK só mantém um índice por vez: libera o de qualquer matcher
+        _liberar_indice_ativo()
+        
         # Cria índice em memória
         MccSdk.CreateMccIndex(
             self.ns, self.nd, self.h, self.l, 
@@ -81,8 +180,7 @@ class MccFingerprintMatcher:
         )
         
         # Obtém todos os arquivos .txt da base
-        arquivos = sorted([f for f in os.listdir(self.pasta_templates) 
-                          if f.lower().endswith('.txt')])
+        arquivos = _listar_templates(self.pasta_templates)
         
         if verbose:
             print(f"📁 Indexando {len(arquivos)} templates...\n")
@@ -90,25 +188,40 @@ class MccFingerprintMatcher:
         sucessos = 0
         erros = []
         
-        for template_id, arquivo in enumerate(arquivos):
-            caminho = os.path.abspath(os.path.join(self.pasta_templates, arquivo))
-            
-            if verbose:
-                print(f"  [{template_id+1:4d}/{len(arquivos):4d}] {arquivo:45s} ", end='', flush=True)
-            
+        total = len(arquivos)
+        progresso = io.StringIO()
+        caminhos = [os.path.abspath(os.path.join(self.pasta_templates, arquivo))
+                    for arquivo in arquivos]
+        
+        # Inserções seriais (o índice do SDK é global e não reentrante); os
+        # próximos arquivos são aquecidos no cache do SO em segundo plano
+        adicionar = MccSdk.AddTextTemplateToMccIndex
+        templates_map = self.templates_map
+        
+        for template_id, (arquivo, caminho) in enumerate(
+                zip(arquivos, iterar_com_prefetch(caminhos))):
             try:
-                MccSdk.AddTextTemplateToMccIndex(caminho, template_id)
-                self.templates_map[template_id] = arquivo
-                
-                if verbose:
-                    print(f"✅")
-                
+                adicionar(caminho, template_id)
+                templates_map[template_id] = arquivo
                 sucessos += 1
                 
             except Exception as e:
                 if verbose:
-                    print(f"❌ {str(e)[:40]}")
+                    progresso.write(f"\r  ❌ {arquivo:45s} {str(e)[:40]}\n")
                 erros.append({'id': template_id, 'arquivo': arquivo, 'erro': str(e)})
+            
+            # Progresso numa única linha reescrita com \r; o buffer só vai
+            # para o terminal a cada 100 templates
+            if verbose and ((template_id + 1) % 100 == 0 or template_id + 1 == total):
+                progresso.write(f"\r  [{template_id+1:4d}/{total:4d}] "
+                                f"✅ {sucessos} indexados, ❌ {len(erros)} erros")
+                sys.stdout.write(progresso.getvalue())
+                sys.stdout.flush()
+                progresso.seek(0)
+                progresso.truncate()
+    
+        if verbose and total:
+            sys.stdout.write("\n")
         
         # Salva índice em disco
         if sucessos > 0:
@@ -124,6 +237,8 @@ class MccFingerprintMatcher:
         # Libera memória
         MccSdk.DeleteMccIndex()
         
+        self._montar_tabelas()
+        
         tempo_total = time.time() - inicio
         
         return {
@@ -143,12 +258,29 @@ class MccFingerprintMatcher:
         Returns:
             int: Número de templates mapeados
         """
-        arquivos = sorted([f for f in os.listdir(self.pasta_templates) 
-                          if f.lower().endswith('.txt')])
+        arquivos = _listar_templates(self.pasta_templates)
         self.templates_map = {i: arq for i, arq in enumerate(arquivos)}
+        self._montar_tabelas()
         return len(self.templates_map)
     
     
+    def _montar_tabelas(self) -> None:
+        """
+        Pré-calcula, indexados por template_id, o nome do arquivo e o
+        caminho completo de cada template, para que a busca faça só duas
+        indexações de lista por candidato.
+        """
+        get_arquivo = self.templates_map.get
+        join = os.path.join
+        pasta = self.pasta_templates
+        total = max(self.templates_map, default=-1) + 1
+        self._arquivos_array = [get_arquivo(i) or f'ID_{i}' for i in range(total)]
+        self._caminhos_array = [join(pasta, arq) for arq in self._arquivos_array]
+        self._known_files = frozenset(
+            self._caminhos_array[i] for i in self.templates_map
+        )
+    
+    
     def buscar_similares(self, arquivo_probe: str, 
                         top_n: int = 5,
                         score_minimo: float = 0.001,
@@ -167,85 +299,96 @@ class MccFingerprintMatcher:
             dict: Resultado em formato JSON com lista de candidatos
         """
         
-        if not os.path.exists(arquivo_probe):
-            raise FileNotFoundError(f"Arquivo não encontrado: {arquivo_probe}")
+        if verbose:
+            print(f"🔍 Buscando similares para: {os.path.basename(arquivo_probe)}")
         
-        if not os.path.exists(self.arquivo_indice):
-            raise FileNotFoundError(f"Índice não encontrado: {self.arquivo_indice}")
+        resultado_final, total_validos, tempo_total = self._buscar(
+            arquivo_probe, top_n, score_minimo, CandidatoSimilar
+        )
+        
+        if verbose:
+            print(f"✅ Encontrados {total_validos} candidatos")
+            print(f"⏱️  Tempo: {tempo_total:.1f}ms")
+            print(f"\nTop {len(resultado_final)} candidatos:")
+            for c in resultado_final:
+                print(f"   #{c.rank}: {c.arquivo:45s} | Score: {c.score:.4f}")
+            print()
+        
+        return resultado_final
+    
+    
+    def _buscar(self, arquivo_probe: str, top_n: int, score_minimo: float,
+                fabrica: Callable) -> Tuple[List, int, float]:
+        """
+        Executa a busca e monta o top-N com `fabrica` (CandidatoSimilar ou
+        _candidato_json), uma única alocação por candidato retornado.
+        
+        Returns:
+            tuple: (lista do top-N, total de candidatos acima do score mínimo,
+                    tempo da busca em ms)
+        """
+        tempo_inicio = time.perf_counter_ns()
+        
+        # Probes da própria base já foram listados: só os demais custam um stat
+        if arquivo_probe not in self._known_files and not os.path.exists(arquivo_probe):
+            raise FileNotFoundError(f"Arquivo não encontrado: {arquivo_probe}")
         
         if not self.templates_map:
             raise ValueError("Mapeamento vazio! Execute carregar_mapeamento() primeiro")
         
-        tempo_inicio = time.time()
-        
-        # Carrega índice na memória
-        MccSdk.LoadMccIndexFromFile(self.arquivo_indice)
+        # Busca no índice residente (recarrega se outro matcher o substituiu)
+        with _SDK_LOCK:
+            if _INDICE_ATIVO is not self:
+                self.carregar_indice()
+            resultado = MccSdk.SearchTextTemplateIntoMccIndex(arquivo_probe, False)
         
+        # O SDK sempre devolve (candidateList, sortedSimilarities)
         try:
-            if verbose:
-                print(f"🔍 Buscando similares para: {os.path.basename(arquivo_probe)}")
-            
-            # Busca no índice
-            resultado = MccSdk.SearchTextTemplateIntoMccIndex(arquivo_probe, False)
-            
-            if not isinstance(resultado, tuple) or len(resultado) != 2:
-                return []
-            
             candidateList, sortedSimilarities = resultado
-            
-            if candidateList is None or len(candidateList) == 0:
-                return []
-            
-            # Coleta TODOS os candidatos com score > score_minimo
-            candidatos_validos = []
-            
-            for i in range(len(candidateList)):
-                candidate_id = int(candidateList[i])
-                score = float(sortedSimilarities[i])
-                
-                # Filtra por score mínimo
-                if score < score_minimo:
-                    continue
-                
-                arquivo = self.templates_map.get(candidate_id, f'ID_{candidate_id}')
+        except (TypeError, ValueError):
+            return [], 0, (time.perf_counter_ns() - tempo_inicio) / 1e6
+        
+        if candidateList is None or len(candidateList) == 0:
+            return [], 0, (time.perf_counter_ns() - tempo_inicio) / 1e6
+        
+        # Um Marshal.Copy por array .NET (sem travessia por elemento);
+        # filtro e seleção do top-N rodam vetorizados
+        n = min(len(candidateList), len(sortedSimilarities))
+        ids = para_numpy(candidateList, n)
+        scores = para_numpy(sortedSimilarities, n).astype(np.float64, copy=False)
+        
+        # O SDK devolve sortedSimilarities em ordem decrescente; confere a
+        # cada busca (uma comparação vetorizada) e, se confirmado, evita ordenar
+        ordenados = bool(np.all(scores[:-1] >= scores[1:]))
+        
+        selecionados, total_validos = selecionar_top_n(
+            scores, top_n, score_minimo, ordenados
+        )
+        
+        # Cria diretamente os objetos do top-N (atributos copiados para
+        # variáveis locais fora do laço)
+        arquivos = self._arquivos_array
+        caminhos = self._caminhos_array
+        total_mapeados = len(arquivos)
+        resultado_final = []
+        adicionar = resultado_final.append
+        for rank, (candidate_id, score) in enumerate(
+                zip(ids[selecionados].tolist(), scores[selecionados].tolist()), start=1):
+            if 0 <= candidate_id < total_mapeados:
+                arquivo = arquivos[candidate_id]
+                caminho = caminhos[candidate_id]
+            else:
+                arquivo = f'ID_{candidate_id}'
                 caminho = os.path.join(self.pasta_templates, arquivo)
-                
-                candidatos_validos.append({
-                    'id': candidate_id,
-                    'arquivo': arquivo,
-                    'caminho': caminho,
-                    'score': score
-                })
-            
-            # Ordena por score (DECRESCENTE - maior primeiro)
-            candidatos_validos.sort(key=lambda x: x['score'], reverse=True)
-            
-            # Pega top-N e cria objetos CandidatoSimilar
-            resultado_final = []
-            for rank, cand in enumerate(candidatos_validos[:top_n], start=1):
-                resultado_final.append(CandidatoSimilar(
-                    id=cand['id'],
-                    arquivo=cand['arquivo'],
-                    caminho_completo=cand['caminho'],
-                    score=cand['score'],
-                    rank=rank
-                ))
-            
-            tempo_total = (time.time() - tempo_inicio) * 1000  # ms
-            
-            if verbose:
-                print(f"✅ Encontrados {len(candidatos_validos)} candidatos")
-                print(f"⏱️  Tempo: {tempo_total:.1f}ms")
-                print(f"\nTop {len(resultado_final)} candidatos:")
-                for c in resultado_final:
-                    print(f"   #{c.rank}: {c.arquivo:45s} | Score: {c.score:.4f}")
-                print()
-            
-            return resultado_final
-            
-        finally:
-            # Libera memória
-            MccSdk.DeleteMccIndex()
+            adicionar(fabrica(
+                id=candidate_id,
+                arquivo=arquivo,
+                caminho_completo=caminho,
+                score=score,
+                rank=rank
+            ))
+        
+        return resultado_final, total_validos, (time.perf_counter_ns() - tempo_inicio) / 1e6
     
     
     def buscar_similares_json(self, arquivo_probe: str, 
@@ -258,32 +401,16 @@ class MccFingerprintMatcher:
             dict: Resultado serializável em JSON
         """
         try:
-            tempo_inicio = time.time()
-            
-            candidatos = self.buscar_similares(
-                arquivo_probe, 
-                top_n=top_n, 
-                score_minimo=score_minimo,
-                verbose=False
+            candidatos, _, tempo_total = self._buscar(
+                arquivo_probe, top_n, score_minimo, _candidato_json
             )
             
-            tempo_total = (time.time() - tempo_inicio) * 1000
-            
             return {
                 'status': 'sucesso',
                 'probe_arquivo': os.path.basename(arquivo_probe),
                 'total_encontrados': len(candidatos),
                 'tempo_ms': tempo_total,
-                'candidatos': [
-                    {
-                        'rank': c.rank,
-                        'id': c.id,
-                        'arquivo': c.arquivo,
-                        'caminho': c.caminho_completo,
-                        'score': c.score
-                    }
-                    for c in candidatos
-                ]
+                'candidatos': candidatos
             }
             
         except Exception as e:
@@ -379,9 +506,15 @@ if __name__ == "__main__":
         print("="*70)
         
         resultado_json = matcher.buscar_similares_json(arquivo_teste, top_n=5)
-        with open("results_query.json", "w") as write_file:
-            json.dumps(resultado_json, indent=2, ensure_ascii=False)
-        print(json.dumps(resultado_json, indent=2, ensure_ascii=False))
+        if orjson is not None:
+            conteudo = orjson.dumps(resultado_json, option=orjson.OPT_INDENT_2)
+            with open("results_query.json", "wb") as write_file:
+                write_file.write(conteudo)
+            print(conteudo.decode("utf-8"))
+        else:
+            with open("results_query.json", "w", encoding="utf-8") as write_file:
+                json.dump(resultado_json, write_file, indent=2, ensure_ascii=False)
+            print(json.dumps(resultado_json, indent=2, ensure_ascii=False))
         print()
     
     else:
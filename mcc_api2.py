@@ -6,132 +6,341 @@ FLUXO:
 1. Flask envia o nome do arquivo probe
 2. MCC Service busca na pasta de templates
 3. Retorna top-5 nomes de arquivos similares + scores
+
+EXECUÇÃO:
+    python mcc_api2.py                      (waitress, 8 threads, se instalado)
+    waitress-serve --threads=8 --port=5001 --call mcc_api2:criar_app
+Use sempre um único processo (o índice MCC é global no processo).
 """
 
-import clr
 import os
 import time
-from typing import Dict
-from flask import Flask, request, jsonify
+import atexit
+import threading
+import numpy as np
+from typing import Dict, List
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+from mcc_comum import iterar_com_prefetch, para_numpy, selecionar_top_n
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional; sem ele as respostas usam jsonify
+    orjson = None
+
+# O índice do MccSdk é global no processo; as threads do Flask compartilham
+# o mesmo índice residente, então toda chamada ao SDK passa por este lock.
+_SDK_LOCK = threading.RLock()
+
+# Carregado sob demanda por _get_sdk(): o CLR só sobe ao criar o matcher
+MccSdk = None
+
+# Matcher dono do índice carregado no SDK (no máximo um por processo)
+_INDICE_ATIVO = None
+
+def _get_sdk():
+    """Carrega o CLR e o MccSdk na primeira chamada e devolve o SDK."""
+    global MccSdk
+    if MccSdk is None:
+        with _SDK_LOCK:
+            if MccSdk is None:
+                import clr
+                clr.AddReference(r"C:\Users\letic\OneDrive\Documentos\sspce\testando_pythonnet\sdk\Sdk\MccSdk.dll")
+                from BioLab.Biometrics.Mcc.Sdk import MccSdk as sdk  # type: ignore
+                MccSdk = sdk
+    return MccSdk
+
+def _liberar_indice_ativo():
+    """Libera o índice do SDK, qualquer que seja o matcher dono."""
+    global _INDICE_ATIVO
+    with _SDK_LOCK:
+        if _INDICE_ATIVO is not None:
+            _INDICE_ATIVO = None
+            MccSdk.DeleteMccIndex()
+
+def _listar_templates(pasta: str) -> List[str]:
+    """Nomes dos templates .txt (qualquer caixa) da pasta, em ordem (a posição é o template_id)."""
+    with os.scandir(pasta) as entradas:
+        return sorted(e.name for e in entradas if e.name[-4:].lower() == '.txt')
 
-clr.AddReference(r"C:\Users\letic\OneDrive\Documentos\sspce\testando_pythonnet\sdk\Sdk\MccSdk.dll")
-from BioLab.Biometrics.Mcc.Sdk import MccSdk  # type: ignore
 
 # ====================================================================
 # CLASSE MCC MATCHER
 # ====================================================================
 class MccMatcherService:
     def __init__(self, pasta_templates: str, arquivo_indice: str):
+        _get_sdk()
         self.pasta_templates = pasta_templates
         self.arquivo_indice = arquivo_indice
         self.templates_map = {}
+        self._arquivos_array: List[str] = []  # template_id -> nome do arquivo
+        self._known_files = frozenset()  # nomes já listados na pasta de templates
+        self._index_loaded = False
         self._carregar_mapeamento()
+        if os.path.exists(self.arquivo_indice):
+            self.carregar_indice()
+        atexit.register(self.liberar_indice)
 
     def _carregar_mapeamento(self):
-        arquivos = sorted([f for f in os.listdir(self.pasta_templates) if f.lower().endswith('.txt')])
+        arquivos = _listar_templates(self.pasta_templates)
         self.templates_map = {i: arq for i, arq in enumerate(arquivos)}
+        self._montar_tabelas()
         print(f"📂 MCC Matcher carregou {len(self.templates_map)} templates.")
 
+    def _montar_tabelas(self):
+        # Nome do arquivo indexado por template_id: a busca faz uma indexação
+        # de lista por candidato em vez de dict.get + f-string de fallback
+        get_arquivo = self.templates_map.get
+        total = max(self.templates_map, default=-1) + 1
+        self._arquivos_array = [get_arquivo(i) or f'ID_{i}' for i in range(total)]
+        self._known_files = frozenset(self.templates_map.values())
+
+    def carregar_indice(self):
+        """
+        Carrega (ou recarrega) o .idx e o mantém residente para as buscas.
+        O índice do SDK é global: substitui o de outro matcher, que recarrega
+        o seu na próxima busca.
+        """
+        global _INDICE_ATIVO
+        with _SDK_LOCK:
+            _liberar_indice_ativo()
+            MccSdk.LoadMccIndexFromFile(self.arquivo_indice)
+            _INDICE_ATIVO = self
+            self._index_loaded = True
+        print(f"📥 Índice MCC carregado: {self.arquivo_indice}")
+
+    def liberar_indice(self):
+        """Libera o índice; só chama DeleteMccIndex se este matcher for o dono."""
+        with _SDK_LOCK:
+            self._index_loaded = False
+            if _INDICE_ATIVO is self:
+                _liberar_indice_ativo()
+
     def criar_indice(self, verbose: bool = True) -> Dict:
         inicio = time.time()
         if verbose:
             print("🔧 Criando índice MCC...")
-        MccSdk.CreateMccIndex(8, 6, 24, 32, 30, 2, 3.14159/4.0, 256, 17)
 
-        arquivos = sorted([f for f in os.listdir(self.pasta_templates) if f.lower().endswith('.txt')])
+        arquivos = _listar_templates(self.pasta_templates)
         sucessos, erros = 0, []
-        for template_id, arquivo in enumerate(arquivos):
-            caminho = os.path.join(self.pasta_templates, arquivo)
-            try:
-                MccSdk.AddTextTemplateToMccIndex(caminho, template_id)
-                self.templates_map[template_id] = arquivo
-                sucessos += 1
-            except Exception as e:
-                erros.append({'id': template_id, 'arquivo': arquivo, 'erro': str(e)})
-
-        if sucessos > 0:
-            MccSdk.SaveMccIndexToFile(self.arquivo_indice)
-        MccSdk.DeleteMccIndex()
+        with _SDK_LOCK:
+            # CreateMccIndex substitui o índice global: libera o residente
+            # (deste ou de outro matcher) antes
+            self.liberar_indice()
+            _liberar_indice_ativo()
+            MccSdk.CreateMccIndex(8, 6, 24, 32, 30, 2, 3.14159/4.0, 256, 17)
+            caminhos = [os.path.join(self.pasta_templates, arquivo) for arquivo in arquivos]
+            # AddTextTemplateToMccIndex escreve no índice global e não é reentrante:
+            # inserções seriais, com os próximos arquivos aquecidos em segundo plano
+            adicionar = MccSdk.AddTextTemplateToMccIndex
+            templates_map = self.templates_map
+            for template_id, (arquivo, caminho) in enumerate(zip(arquivos, iterar_com_prefetch(caminhos))):
+                try:
+                    adicionar(caminho, template_id)
+                    templates_map[template_id] = arquivo
+                    sucessos += 1
+                except Exception as e:
+                    erros.append({'id': template_id, 'arquivo': arquivo, 'erro': str(e)})
+                if verbose and (template_id + 1) % 100 == 0:
+                    print(f"   [{template_id+1}/{len(arquivos)}] {sucessos} templates indexados")
+
+            if sucessos > 0:
+                MccSdk.SaveMccIndexToFile(self.arquivo_indice)
+            MccSdk.DeleteMccIndex()
+            self._montar_tabelas()
+            if sucessos > 0:
+                self.carregar_indice()
         print(f"✅ Índice MCC criado: {sucessos}/{len(arquivos)} templates.")
         return {'total': len(arquivos), 'sucessos': sucessos, 'erros': len(erros), 'tempo_segundos': time.time()-inicio}
 
-    def buscar_similares(self, nome_probe: str, top_n: int = 5, score_minimo: float = 0.001) -> Dict:
+    def buscar_similares(self, nome_probe: str, top_n: int = 5, score_minimo: float = 0.001, verbose: bool = False) -> Dict:
+        # Só a chamada ao SDK em _buscar fica sob o lock; stat, logs e o
+        # pós-processamento rodam em paralelo entre as threads do servidor
+        return self._buscar(nome_probe, top_n, score_minimo, verbose, MccSdk.SearchTextTemplateIntoMccIndex)
+
+    def buscar_similares_lote(self, nomes_probe: List[str], top_n: int = 5, score_minimo: float = 0.001) -> Dict:
+        """Busca vários probes com uma única aquisição do lock do SDK."""
+        tempo_inicio = time.perf_counter_ns()
+        search = MccSdk.SearchTextTemplateIntoMccIndex
+        with _SDK_LOCK:
+            resultados = [self._buscar(nome, top_n, score_minimo, False, search) for nome in nomes_probe]
+        return {'status': 'sucesso', 'total_probes': len(resultados), 'tempo_ms': (time.perf_counter_ns()-tempo_inicio)/1e6, 'resultados': resultados}
+
+    def _buscar(self, nome_probe: str, top_n: int, score_minimo: float, verbose: bool, search) -> Dict:
+        # Adquire _SDK_LOCK só para a busca no SDK (RLock: o lote já o detém)
         caminho_probe = os.path.join(self.pasta_templates, nome_probe)
-        if not os.path.exists(caminho_probe):
+        # Probes já mapeados dispensam o stat; só nomes novos vão ao disco
+        if nome_probe not in self._known_files and not os.path.exists(caminho_probe):
             print(f"❌ Probe não encontrado: {caminho_probe}")
             return {'status': 'erro', 'mensagem': f'Arquivo não encontrado: {nome_probe}', 'candidatos': []}
 
         print(f"🔎 Iniciando busca MCC para: {nome_probe}")
 
-        if not os.path.exists(self.arquivo_indice):
-            print("❌ Índice MCC não encontrado. Execute setup primeiro.")
+        if not self._index_loaded:
+            print("❌ Índice MCC não carregado. Execute setup primeiro.")
             return {'status': 'erro', 'mensagem': 'Índice não encontrado. Execute setup primeiro.', 'candidatos': []}
 
-        tempo_inicio = time.time()
-        MccSdk.LoadMccIndexFromFile(self.arquivo_indice)
+        tempo_inicio = time.perf_counter_ns()
 
         try:
-            resultado = MccSdk.SearchTextTemplateIntoMccIndex(caminho_probe, False)
+            with _SDK_LOCK:
+                # Recarrega se outro matcher substituiu o índice global do SDK
+                if _INDICE_ATIVO is not self:
+                    self.carregar_indice()
+                resultado = search(caminho_probe, False)
             candidateList, sortedSimilarities = resultado
 
             if not candidateList:
                 print("⚠️ Nenhum candidato encontrado no MCC.")
-                return {'status': 'sucesso', 'probe_arquivo': nome_probe, 'total_encontrados': 0, 'tempo_ms': (time.time()-tempo_inicio)*1000, 'candidatos': []}
+                return {'status': 'sucesso', 'probe_arquivo': nome_probe, 'total_encontrados': 0, 'tempo_ms': (time.perf_counter_ns()-tempo_inicio)/1e6, 'candidatos': []}
+
+            # Um Marshal.Copy por array .NET (sem travessia por elemento); filtro e top-N vetorizados
+            n = min(len(candidateList), len(sortedSimilarities))
+            ids = para_numpy(candidateList, n)
+            scores = para_numpy(sortedSimilarities, n).astype(np.float64, copy=False)
+
+            # sortedSimilarities vem em ordem decrescente do SDK; confere a cada
+            # busca e, se confirmado, o top-N é só o prefixo acima do score mínimo
+            ordenados = bool(np.all(scores[:-1] >= scores[1:]))
 
-            candidatos_validos = []
-            for i in range(len(candidateList)):
-                candidate_id = int(candidateList[i])
-                score = float(sortedSimilarities[i])
-                if score < score_minimo:
-                    continue
-                arquivo = self.templates_map.get(candidate_id, f'ID_{candidate_id}')
-                candidatos_validos.append({'id': candidate_id, 'arquivo': arquivo, 'score': score})
-                print(f"✅ Candidato encontrado: {arquivo} | Score MCC: {score}")
+            selecionados, total_validos = selecionar_top_n(scores, top_n, score_minimo, ordenados)
 
-            candidatos_validos.sort(key=lambda x: x['score'], reverse=True)
-            candidatos_json = [{'rank': r+1, 'arquivo': c['arquivo'], 'score_mcc': c['score']} for r, c in enumerate(candidatos_validos[:top_n])]
+            arquivos = self._arquivos_array
+            total_mapeados = len(arquivos)
+            candidatos_json = []
+            adicionar = candidatos_json.append
+            for r, (candidate_id, score) in enumerate(zip(ids[selecionados].tolist(), scores[selecionados].tolist()), 1):
+                arquivo = arquivos[candidate_id] if 0 <= candidate_id < total_mapeados else f'ID_{candidate_id}'
+                adicionar({'rank': r, 'arquivo': arquivo, 'score_mcc': score})
+
+            if verbose:
+                print('\n'.join(f"✅ Candidato encontrado: {c['arquivo']} | Score MCC: {c['score_mcc']}" for c in candidatos_json))
 
             print(f"📄 Retornando top-{len(candidatos_json)} candidatos para {nome_probe}")
-            print(f"⏱️ Tempo total MCC: {round((time.time()-tempo_inicio)*1000, 2)} ms\n")
+            tempo_ms = (time.perf_counter_ns()-tempo_inicio)/1e6
+            print(f"⏱️ Tempo total MCC: {round(tempo_ms, 2)} ms\n")
 
-            return {'status': 'sucesso', 'probe_arquivo': nome_probe, 'total_encontrados': len(candidatos_validos), 'tempo_ms': (time.time()-tempo_inicio)*1000, 'candidatos': candidatos_json}
+            return {'status': 'sucesso', 'probe_arquivo': nome_probe, 'total_encontrados': total_validos, 'tempo_ms': tempo_ms, 'candidatos': candidatos_json}
 
         except Exception as e:
             print(f"💥 Erro ao buscar similares MCC: {e}")
             return {'status': 'erro', 'mensagem': str(e), 'candidatos': []}
 
-        finally:
-            MccSdk.DeleteMccIndex()
-
 
 # ====================================================================
 # FLASK SERVICE
 # ====================================================================
 app = Flask(__name__)
+app.json.compact = True  # respostas sem indentação, com separadores (",", ":")
 CORS(app)
 
 PASTA_TEMPLATES = r'C:\Users\letic\OneDrive\Documentos\sspce\testando_pythonnet\templates'
 ARQUIVO_INDICE = r'C:\Users\letic\OneDrive\Documentos\sspce\testando_pythonnet\mcc_index.idx'
 
-matcher = MccMatcherService(PASTA_TEMPLATES, ARQUIVO_INDICE)
+# O matcher (CLR + índice) sobe em segundo plano, a partir de _iniciar(), para
+# o /health responder durante o boot; as demais rotas devolvem 503 até ele
+# ficar pronto. Importar o módulo não carrega o CLR
+matcher = None
+_matcher_pronto = threading.Event()
+_erro_inicializacao = None
+_inicializacao = None
+_inicializacao_lock = threading.Lock()
+
+def _iniciar_matcher():
+    global matcher, _erro_inicializacao
+    try:
+        matcher = MccMatcherService(PASTA_TEMPLATES, ARQUIVO_INDICE)
+    except Exception as e:
+        _erro_inicializacao = str(e)
+        print(f"💥 Erro ao iniciar MCC Matcher: {e}")
+        raise
+    finally:
+        _matcher_pronto.set()
+
+def _iniciar():
+    """Dispara a inicialização do matcher em segundo plano (só uma vez)."""
+    global _inicializacao
+    with _inicializacao_lock:
+        if _inicializacao is None:
+            _inicializacao = threading.Thread(target=_iniciar_matcher, name='mcc-init', daemon=True)
+            _inicializacao.start()
+
+def criar_app():
+    """Entrada do waitress-serve (--call): inicia o matcher e devolve o app."""
+    _iniciar()
+    return app
+
+@app.before_request
+def _exigir_matcher():
+    _iniciar()  # servido como mcc_api2:app sem passar por criar_app()
+    if request.endpoint == 'health':
+        return None
+    if not _matcher_pronto.is_set():
+        return jsonify({'status': 'erro', 'mensagem': 'Serviço MCC iniciando'}), 503
+    if matcher is None:
+        return jsonify({'status': 'erro', 'mensagem': f'Falha ao iniciar o MCC: {_erro_inicializacao}'}), 503
+    return None
+
+MAX_TOP_N = 100
+MAX_PROBES_LOTE = 50  # o lote inteiro roda com o lock do SDK adquirido
+
+def _parametros_busca(data):
+    """Lê top_n/score_minimo do cliente; top_n é limitado a MAX_TOP_N."""
+    try:
+        top_n = int(data.get('top_n', 5))
+        score_minimo = float(data.get('score_minimo', 0.001))
+    except (TypeError, ValueError, OverflowError):  # OverflowError: int(Infinity)
+        raise ValueError('Campos "top_n" e "score_minimo" devem ser numéricos')
+    if top_n < 0 or not score_minimo >= 0:  # "not >=" também rejeita NaN
+        raise ValueError('Campos "top_n" e "score_minimo" não podem ser negativos')
+    return min(top_n, MAX_TOP_N), score_minimo
+
+def _resposta_json(payload):
+    # orjson serializa direto para bytes, sem o encode do str que o jsonify faz
+    if orjson is None:
+        return jsonify(payload)
+    return Response(orjson.dumps(payload), mimetype='application/json')
 
 @app.route('/health', methods=['GET'])
 def health():
-    return {'status': 'online', 'templates': len(matcher.templates_map), 'indice_existe': os.path.exists(ARQUIVO_INDICE)}
+    if not _matcher_pronto.is_set():
+        return {'status': 'iniciando'}, 503
+    if matcher is None:
+        return {'status': 'erro', 'mensagem': _erro_inicializacao}, 503
+    return {'status': 'online', 'templates': len(matcher.templates_map), 'indice_existe': matcher._index_loaded or os.path.exists(ARQUIVO_INDICE)}
 
 @app.route('/search', methods=['POST'])
 def search():
     data = request.get_json()
-    if not data or 'probe_file' not in data:
+    if not isinstance(data, dict) or 'probe_file' not in data:
         return jsonify({'status': 'erro', 'mensagem': 'Campo "probe_file" obrigatório'}), 400
 
     nome_probe = data['probe_file']
-    top_n = data.get('top_n', 5)
-    score_minimo = data.get('score_minimo', 0.001)
+    try:
+        top_n, score_minimo = _parametros_busca(data)
+    except ValueError as e:
+        return jsonify({'status': 'erro', 'mensagem': str(e)}), 400
 
     resultado = matcher.buscar_similares(nome_probe, top_n=top_n, score_minimo=score_minimo)
-    return jsonify(resultado)
+    return _resposta_json(resultado)
+
+@app.route('/search_batch', methods=['POST'])
+def search_batch():
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get('probe_files'), list):
+        return jsonify({'status': 'erro', 'mensagem': 'Campo "probe_files" (lista) obrigatório'}), 400
+    if len(data['probe_files']) > MAX_PROBES_LOTE:
+        return jsonify({'status': 'erro', 'mensagem': f'Campo "probe_files" aceita no máximo {MAX_PROBES_LOTE} arquivos'}), 400
+    if not all(isinstance(nome, str) for nome in data['probe_files']):
+        return jsonify({'status': 'erro', 'mensagem': 'Campo "probe_files" deve conter apenas nomes de arquivo (texto)'}), 400
+
+    try:
+        top_n, score_minimo = _parametros_busca(data)
+    except ValueError as e:
+        return jsonify({'status': 'erro', 'mensagem': str(e)}), 400
+
+    resultado = matcher.buscar_similares_lote(data['probe_files'], top_n=top_n, score_minimo=score_minimo)
+    return _resposta_json(resultado)
 
 @app.route('/setup', methods=['POST'])
 def setup():
@@ -139,7 +348,27 @@ def setup():
     matcher._carregar_mapeamento()
     return jsonify({'status': 'sucesso', 'mensagem': 'Índice criado', 'estatisticas': resultado})
 
+@app.route('/reload', methods=['POST'])
+def reload():
+    if not os.path.exists(ARQUIVO_INDICE):
+        return jsonify({'status': 'erro', 'mensagem': 'Índice não encontrado. Execute setup primeiro.'}), 404
+    matcher._carregar_mapeamento()
+    matcher.carregar_indice()
+    return jsonify({'status': 'sucesso', 'mensagem': 'Índice recarregado', 'templates': len(matcher.templates_map)})
+
 if __name__ == "__main__":
+    _iniciar()
+    _matcher_pronto.wait()
+    if matcher is None:
+        raise SystemExit(1)
     if not os.path.exists(ARQUIVO_INDICE):
         matcher.criar_indice(verbose=True)
-    app.run(host='0.0.0.0', port=5001, debug=False)
\ No newline at end of file
+    # Um único processo com várias threads: o índice MCC é global no processo,
+    # então as threads compartilham o índice residente (protegido por _SDK_LOCK)
+    try:
+        from waitress import serve
+    except ImportError:
+        print("⚠️ waitress não instalado; usando servidor de desenvolvimento do Flask.")
+        app.run(host='0.0.0.0', port=5001, debug=False, threaded=True)
+    else:
+        serve(app, host='0.0.0.0', port=5001, threads=8)
\ No newline at end of file
@@ -0,0 +1,190 @@
+using System;
+using System.Collections.Concurrent;
+using System.Collections.Generic;
+using System.IO;
+using System.Linq;
+using System.Threading;
+using System.Threading.Tasks;
+using BioLab.Biometrics.Mcc.Sdk;
+
+namespace MccBatch
+{
+    /// <summary>
+    /// Resultado de uma inserção em lote, devolvido ao Python num único objeto.
+    /// </summary>
+    public sealed class BatchResult
+    {
+        public BatchResult(int sucessos, int[] indicesFalhos, string[] mensagensFalhas)
+        {
+            Sucessos = sucessos;
+            IndicesFalhos = indicesFalhos;
+            MensagensFalhas = mensagensFalhas;
+        }
+
+        /// <summary>Número de templates adicionados ao índice.</summary>
+        public int Sucessos { get; }
+
+        /// <summary>Posições (em <c>paths</c>) dos templates que falharam.</summary>
+        public int[] IndicesFalhos { get; }
+
+        /// <summary>Mensagem de erro de cada posição em <see cref="IndicesFalhos"/>.</summary>
+        public string[] MensagensFalhas { get; }
+    }
+
+    /// <summary>
+    /// Resultado de <see cref="BatchIndexer.BuildFromFolder"/>: o lote e os
+    /// nomes dos arquivos na ordem dos template_id.
+    /// </summary>
+    public sealed class FolderBuildResult
+    {
+        public FolderBuildResult(BatchResult lote, string[] arquivos)
+        {
+            Lote = lote;
+            Arquivos = arquivos;
+        }
+
+        /// <summary>Sucessos e falhas da inserção.</summary>
+        public BatchResult Lote { get; }
+
+        /// <summary>Nome de cada template; a posição é o template_id.</summary>
+        public string[] Arquivos { get; }
+    }
+
+    /// <summary>
+    /// Indexa uma pasta de templates no índice MCC global em uma única chamada
+    /// vinda do Python (<see cref="BuildFromFolder"/>), evitando uma travessia
+    /// pythonnet -> CLR por arquivo.
+    /// </summary>
+    public static class BatchIndexer
+    {
+        // Mesmo critério de _TXT_SUFFIX no mcc_service.py (.txt em qualquer
+        // caixa): a seleção e a ordem dos arquivos (e portanto os
+        // template_id) precisam bater
+        private const string SufixoTemplate = ".txt";
+
+        /// <summary>
+        /// Adiciona <c>paths[i]</c> com template_id <c>startId + i</c>.
+        /// Falhas não interrompem o lote; são devolvidas no resultado.
+        /// </summary>
+        private static BatchResult AddAllSequencial(string[] paths, int startId,
+                                                    Action<int, int> progresso, int intervalo)
+        {
+            var indicesFalhos = new List<int>();
+            var mensagensFalhas = new List<string>();
+            int sucessos = 0;
+
+            for (int i = 0; i < paths.Length; i++)
+            {
+                try
+                {
+                    MccSdk.AddTextTemplateToMccIndex(paths[i], startId + i);
+                    sucessos++;
+                }
+                catch (Exception e)
+                {
+                    indicesFalhos.Add(i);
+                    mensagensFalhas.Add(e.Message);
+                }
+
+                if (progresso != null && ((i + 1) % intervalo == 0 || i + 1 == paths.Length))
+                {
+                    progresso(i + 1, paths.Length);
+                }
+            }
+
+            return new BatchResult(sucessos, indicesFalhos.ToArray(), mensagensFalhas.ToArray());
+        }
+
+        /// <summary>
+        /// Como <see cref="AddAllSequencial"/>, mas distribui as faixas de <c>paths</c>
+        /// entre os núcleos com <c>Parallel.ForEach</c>.
+        /// Só é seguro se o MccSdk aceitar inserções concorrentes no índice
+        /// global; por isso o Python só usa este caminho quando pedido.
+        /// </summary>
+        private static BatchResult AddAllParallel(string[] paths, int startId)
+        {
+            // Partitioner.Create(0, 0) lança ArgumentOutOfRangeException
+            if (paths.Length == 0)
+            {
+                return new BatchResult(0, new int[0], new string[0]);
+            }
+
+            var falhas = new ConcurrentBag<Tuple<int, string>>();
+            int sucessos = 0;
+
+            Parallel.ForEach(Partitioner.Create(0, paths.Length), faixa =>
+            {
+                int sucessosFaixa = 0;
+                for (int i = faixa.Item1; i < faixa.Item2; i++)
+                {
+                    try
+                    {
+                        MccSdk.AddTextTemplateToMccIndex(paths[i], startId + i);
+                        sucessosFaixa++;
+                    }
+                    catch (Exception e)
+                    {
+                        falhas.Add(Tuple.Create(i, e.Message));
+                    }
+                }
+                Interlocked.Add(ref sucessos, sucessosFaixa);
+            });
+
+            var ordenadas = falhas.OrderBy(f => f.Item1).ToArray();
+            return new BatchResult(
+                sucessos,
+                ordenadas.Select(f => f.Item1).ToArray(),
+                ordenadas.Select(f => f.Item2).ToArray());
+        }
+
+        /// <summary>
+        /// Pipeline completo de indexação numa única chamada vinda do Python:
+        /// cria o índice global, lista os templates da pasta (ordem ordinal
+        /// dos nomes, como o sorted() do Python), adiciona com template_id =
+        /// posição, salva em <c>outPath</c> se houve sucessos e libera o índice.
+        /// </summary>
+        /// <param name="progresso">
+        /// Opcional; recebe (processados, total) a cada <c>intervalo</c>
+        /// arquivos. No modo paralelo só é chamado ao fim.
+        /// </param>
+        public static FolderBuildResult BuildFromFolder(
+            string folder, string outPath,
+            int ns, int nd, int h, int l, int minNS, int minNP,
+            double deltaTheta, int deltaXY, int randomSeed,
+            bool paralelo, Action<int, int> progresso, int intervalo)
+        {
+            var arquivos = Directory.EnumerateFiles(folder)
+                .Select(Path.GetFileName)
+                .Where(nome => nome.EndsWith(SufixoTemplate, StringComparison.OrdinalIgnoreCase))
+                .OrderBy(nome => nome, StringComparer.Ordinal)
+                .ToArray();
+            var caminhos = arquivos.Select(nome => Path.Combine(folder, nome)).ToArray();
+
+            MccSdk.CreateMccIndex(ns, nd, h, l, minNS, minNP, deltaTheta, deltaXY, randomSeed);
+            try
+            {
+                BatchResult lote;
+                if (paralelo)
+                {
+                    lote = AddAllParallel(caminhos, 0);
+                    progresso?.Invoke(caminhos.Length, caminhos.Length);
+                }
+                else
+                {
+                    lote = AddAllSequencial(caminhos, 0, progresso, Math.Max(1, intervalo));
+                }
+
+                if (lote.Sucessos > 0)
+                {
+                    MccSdk.SaveMccIndexToFile(outPath);
+                }
+
+                return new FolderBuildResult(lote, arquivos);
+            }
+            finally
+            {
+                MccSdk.DeleteMccIndex();
+            }
+        }
+    }
+}
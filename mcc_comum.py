@@ -0,0 +1,124 @@
+"""
+Funções compartilhadas por mcc_api.py, mcc_api2.py e mcc_service.py
+(leitura antecipada dos templates na indexação, cópia dos resultados do
+SDK para NumPy e seleção do top-N).
+
+Não depende do CLR: importar este módulo não carrega o MccSdk.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+
+# Leitura antecipada na indexação: threads e arquivos à frente da inserção
+THREADS_PREFETCH = 4
+JANELA_PREFETCH = 16
+
+
+def aquecer_arquivo(caminho: str) -> None:
+    """
+    Traz o arquivo ao cache do SO antes de o SDK lê-lo: posix_fadvise
+    (WILLNEED) onde existe, senão uma leitura descartada em segundo plano.
+    """
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            fd = os.open(caminho, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+        else:
+            with open(caminho, 'rb') as f:
+                while f.read(1 << 20):
+                    pass
+    except OSError:
+        pass  # o erro real é reportado pelo SDK na indexação
+
+
+def iterar_com_prefetch(caminhos: List[str]) -> Iterator[str]:
+    """
+    Percorre `caminhos` em ordem; enquanto o chamador processa um arquivo,
+    os próximos JANELA_PREFETCH são aquecidos em THREADS_PREFETCH threads.
+
+    O MccSdk mantém um único índice global e AddTextTemplateToMccIndex não
+    é reentrante: as inserções continuam seriais no chamador, só a leitura
+    dos arquivos é adiantada.
+    """
+    total = len(caminhos)
+    with ThreadPoolExecutor(max_workers=THREADS_PREFETCH) as pool:
+        leituras = deque(pool.submit(aquecer_arquivo, caminho)
+                         for caminho in caminhos[:JANELA_PREFETCH])
+        proximo = len(leituras)
+
+        for caminho in caminhos:
+            leituras.popleft().result()
+            if proximo < total:
+                leituras.append(pool.submit(aquecer_arquivo, caminhos[proximo]))
+                proximo += 1
+            yield caminho
+
+
+# Tipos primitivos .NET copiáveis com Marshal.Copy
+_DTYPES_NET = {
+    'System.Int32': np.int32,
+    'System.Int64': np.int64,
+    'System.Single': np.float32,
+    'System.Double': np.float64,
+}
+
+
+def para_numpy(valores, n: int) -> np.ndarray:
+    """
+    Copia os n primeiros elementos de um array .NET para NumPy com um único
+    Marshal.Copy, em vez de uma travessia pythonnet por elemento.
+    Se o SDK devolver algo que não é array primitivo (ex.: IList), converte
+    com um único list().
+    """
+    tipo = valores.GetType() if hasattr(valores, 'GetType') else None
+    if tipo is not None and tipo.IsArray:
+        dtype = _DTYPES_NET.get(tipo.GetElementType().FullName)
+        if dtype is not None:
+            # Só chega aqui com um objeto .NET: o CLR já está carregado
+            from System import IntPtr
+            from System.Runtime.InteropServices import Marshal
+            destino = np.empty(n, dtype=dtype)
+            if n > 0:
+                Marshal.Copy(valores, 0, IntPtr(destino.ctypes.data), n)
+            return destino
+    return np.array(list(valores)[:n])
+
+
+def selecionar_top_n(scores: np.ndarray, top_n: int, score_minimo: float,
+                     ordenados: bool) -> Tuple[np.ndarray, int]:
+    """
+    Seleciona os índices do top-N (score decrescente) entre os candidatos
+    com score >= score_minimo.
+
+    Returns:
+        tuple: (índices do top-N em `scores`, total acima do score mínimo)
+    """
+    if ordenados:
+        # -scores é crescente: o corte do score mínimo é uma busca binária
+        total_validos = int(np.searchsorted(-scores, -score_minimo, side='right'))
+        return np.arange(max(0, min(total_validos, top_n))), total_validos
+
+    validos = np.flatnonzero(scores >= score_minimo)
+    total_validos = len(validos)
+    k = max(0, min(total_validos, top_n))
+    negativos = -scores[validos]
+    if 0 < k < total_validos:
+        # Mesmo critério do sort estável: (score decrescente, posição). No
+        # corte, entre scores empatados ficam os de menor posição; `parte`
+        # fica em ordem de posição para o argsort estável preservá-la
+        limite = np.partition(negativos, k - 1)[k - 1]
+        acima = np.flatnonzero(negativos < limite)
+        empatados = np.flatnonzero(negativos == limite)[:k - len(acima)]
+        parte = np.sort(np.concatenate((acima, empatados)))
+        ordem = parte[np.argsort(negativos[parte], kind='stable')]
+    else:
+        ordem = np.argsort(negativos, kind='stable')[:k]
+    return validos[ordem], total_validos
@@ -1,170 +1,676 @@
-import clr  # módulo principal do pythonnet
+import atexit
+import mmap
 import os
+import sys
 
-# Adiciona uma referência a uma biblioteca padrão do .NET
-clr.AddReference("System")
-clr.AddReference(r"C:\\Users\\letic\\OneDrive\\Documentos\\sspce\\testando_pythonnet\\sdk\\Sdk\\MccSdk.dll")
+import numpy as np
 
-from BioLab.Biometrics.Mcc.Sdk import MccSdk
+from mcc_comum import iterar_com_prefetch, para_numpy
 
-def criar_indice_mcc(pasta_templates, arquivo_indice_saida, verbose=True):
-    """
-    Cria um índice MCC a partir de arquivos de template de minúcias.
+# DLLs do SDK, relativas a este arquivo (sdk/Sdk/ ao lado do script)
+PASTA_SDK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sdk', 'Sdk')
+ARQUIVO_MCC_SDK = os.path.join(PASTA_SDK, 'MccSdk.dll')
+
+# Helper opcional (mcc_batch/), compilado ao lado do MccSdk.dll
+ARQUIVO_MCC_BATCH = os.path.join(PASTA_SDK, 'MccBatch.dll')
+_BATCH_INDEXER = None
+
+# Carregados sob demanda por _ensure_sdk(): importar este módulo não sobe o CLR
+_SDK_LOADED = False
+MccSdk = None
+
+
+def _ensure_sdk():
+    """Carrega o CLR e o MccSdk na primeira chamada."""
+    global _SDK_LOADED, MccSdk
+    if _SDK_LOADED:
+        return
     
-    Args:
-        pasta_templates: Caminho da pasta contendo arquivos .txt com minúcias
-        arquivo_indice_saida: Caminho onde salvar o arquivo .idx
-        verbose: Se True, mostra progresso detalhado
+    import clr  # módulo principal do pythonnet
+    
+    # Adiciona uma referência a uma biblioteca padrão do .NET
+    clr.AddReference("System")
+    clr.AddReference(ARQUIVO_MCC_SDK)
+    
+    from BioLab.Biometrics.Mcc.Sdk import MccSdk as sdk
+    
+    MccSdk = sdk
+    _SDK_LOADED = True
+
+
+def _carregar_batch_indexer():
+    """
+    Carrega o BatchIndexer do MccBatch.dll, se ele foi compilado.
     
     Returns:
-        tuple: (num_sucessos, num_erros, lista_erros)
+        BatchIndexer ou None quando a DLL não existe
     """
+    global _BATCH_INDEXER
+    if _BATCH_INDEXER is None and os.path.exists(ARQUIVO_MCC_BATCH):
+        _ensure_sdk()
+        import clr
+        clr.AddReference(ARQUIVO_MCC_BATCH)
+        from MccBatch import BatchIndexer
+        _BATCH_INDEXER = BatchIndexer
+    return _BATCH_INDEXER
+
+
+# Sufixo dos templates, em qualquer caixa; só os 4 últimos caracteres
+# do nome passam por .lower()
+_TXT_SUFFIX = '.txt'
+
+
+def _listar_templates(pasta_templates):
+    """
+    Arquivos .txt da pasta (DirEntry), na ordem que define os template_id.
     
-    # Parâmetros do índice MCC
-    ns = 8              # número de setores
-    nd = 6              # número de direções
-    h = 24              # altura da célula
-    l = 32              # largura da célula
-    minNS = 30          # mínimo de células não vazias
-    minNP = 2           # mínimo de pares
-    deltaTheta = 3.14159 / 4.0  # tolerância angular
-    deltaXY = 256       # tolerância espacial
-    randomSeed = 17     # semente aleatória
+    A pasta é listada a partir do caminho absoluto, então entrada.path já
+    serve direto para o SDK, sem join/abspath por arquivo.
+    """
+    with os.scandir(os.path.abspath(pasta_templates)) as it:
+        entradas = [e for e in it
+                    if e.is_file() and e.name[-4:].lower() == _TXT_SUFFIX]
+    entradas.sort(key=lambda e: e.name)
+    return entradas
+
+
+def _arquivo_nomes(arquivo_indice):
+    """
+    Caminho do arquivo auxiliar com os nomes indexados (ao lado do .idx):
+    UTF-8, um nome por linha, linha = template_id.
+    """
+    return arquivo_indice + '.names'
+
+
+def _ler_nomes(arquivo_nomes):
+    """Lê o <indice>.names com um único mmap + split."""
+    if os.path.getsize(arquivo_nomes) == 0:
+        return ['']
+    with open(arquivo_nomes, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+            return mapa[:].decode('utf-8').split('\n')
+
+
+def _nome_por_id(nomes, template_id):
+    """Nome do arquivo de um template_id, ou 'ID_<n>' se desconhecido."""
+    if 0 <= template_id < len(nomes) and nomes[template_id]:
+        return nomes[template_id]
+    return f"ID_{template_id}"
+
+
+def carregar_nomes(arquivo_indice, pasta_templates):
+    """
+    Lê a lista template_id -> nome do arquivo de um índice.
     
-    if verbose:
-        print("🧠 Criando índice MCC...")
+    Usa o arquivo <indice>.names gravado por criar_indice_mcc; se ele não
+    existir, lista a pasta de templates na mesma ordem da indexação. Cada MccIndex guarda a sua
+    própria lista, lida ao carregar o índice.
     
-    MccSdk.CreateMccIndex(ns, nd, h, l, minNS, minNP, deltaTheta, deltaXY, randomSeed)
+    Args:
+        arquivo_indice: Caminho do .idx
+        pasta_templates: Pasta com os templates originais
     
-    if verbose:
-        print("✅ Índice criado!\n")
+    Returns:
+        list: Nomes dos arquivos por template_id ('' para IDs que falharam)
+    """
+    arquivo_nomes = _arquivo_nomes(arquivo_indice)
+    if os.path.exists(arquivo_nomes):
+        return _ler_nomes(arquivo_nomes)
+    return [e.name for e in _listar_templates(pasta_templates)]
+
+
+def _erros_do_lote(lote, todos_arquivos, verbose):
+    """
+    Converte o BatchResult do MccBatch.dll para o formato de erros do Python.
     
-    # Obtém lista de arquivos .txt
-    todos_arquivos = sorted([f for f in os.listdir(pasta_templates) 
-                            if f.lower().endswith('.txt')])
+    Returns:
+        tuple: (templates_adicionados, lista_erros)
+    """
+    total = len(todos_arquivos)
+    erros = []
+    for posicao, mensagem in zip(lote.IndicesFalhos, lote.MensagensFalhas):
+        posicao = int(posicao)
+        erros.append({
+            'posicao': posicao + 1,
+            'arquivo': todos_arquivos[posicao],
+            'id': posicao,
+            'erro': str(mensagem)
+        })
+        if verbose:
+            print(f"[{posicao + 1:3d}/{total:3d}] {todos_arquivos[posicao]:35s} ❌ {str(mensagem)[:50]}")
     
     if verbose:
-        print(f"📁 Processando {len(todos_arquivos)} arquivos...\n")
+        print(f"✅ {lote.Sucessos}/{total} templates adicionados em lote")
     
+    return int(lote.Sucessos), erros
+
+
+# Arquivos por escrita de progresso na indexação um a um
+INTERVALO_PROGRESSO = 64
+
+def _adicionar_um_a_um(caminhos, todos_arquivos, verbose):
+    """
+    Adiciona os templates um por vez (sem o helper MccBatch.dll).
+    O progresso é acumulado em buffer e escrito a cada
+    INTERVALO_PROGRESSO arquivos, sem flush por arquivo.
+    
+    Returns:
+        tuple: (templates_adicionados, lista_erros)
+    """
     template_id = 0
     templates_adicionados = 0
     erros = []
-    
-    for i, arquivo in enumerate(todos_arquivos, 1):
-        caminho_completo = os.path.join(pasta_templates, arquivo)
-        caminho_absoluto = os.path.abspath(caminho_completo)
-        
+    buffer = []
+    total = len(todos_arquivos)
+    
+    # O SDK só aceita caminhos e o índice global não é reentrante: as
+    # inserções seguem seriais, e iterar_com_prefetch aquece os próximos
+    # arquivos enquanto o SDK processa o atual. Os caminhos já vêm
+    # absolutos do scandir: nenhum join/abspath por arquivo
+    for i, (arquivo, caminho_absoluto) in enumerate(
+            zip(todos_arquivos, iterar_com_prefetch(caminhos)), 1):
         if verbose:
-            print(f"[{i:3d}/{len(todos_arquivos):3d}] {arquivo:35s} ", end='', flush=True)
+            buffer.append(f"[{i:3d}/{total:3d}] {arquivo:35s} ")
         
         try:
             MccSdk.AddTextTemplateToMccIndex(caminho_absoluto, template_id)
             
             if verbose:
-                print(f"✅ ID {template_id}")
+                buffer.append(f"✅ ID {template_id}\n")
             
             template_id += 1
             templates_adicionados += 1
             
         except Exception as e:
+            mensagem = str(e)
             if verbose:
-                print(f"❌ {str(e)[:50]}")
+                buffer.append(f"❌ {mensagem[:50]}\n")
             
             erros.append({
                 'posicao': i,
                 'arquivo': arquivo,
                 'id': template_id,
-                'erro': str(e)
+                'erro': mensagem
             })
             template_id += 1
+        
+        if verbose and (i % INTERVALO_PROGRESSO == 0 or i == total):
+            sys.stdout.write(''.join(buffer))
+            sys.stdout.flush()
+            buffer.clear()
+
+    return templates_adicionados, erros
+
+
+def _criar_no_clr(indexador, pasta_templates, arquivo_indice_saida, parametros,
+                  verbose, paralelo):
+    """
+    Indexa a pasta inteira com uma única chamada ao BatchIndexer.BuildFromFolder
+    (cria, lista, adiciona, salva e libera o índice do lado do CLR).
     
-    # Salva índice
-    if templates_adicionados > 0:
+    Returns:
+        tuple: (templates_adicionados, lista_erros, nomes_por_id)
+    """
+    progresso = None
+    if verbose:
+        from System import Action, Int32
+        
+        def _mostrar_progresso(processados, total):
+            sys.stdout.write(f"\r   [{processados:4d}/{total:4d}] templates processados")
+            sys.stdout.flush()
+        
+        progresso = Action[Int32, Int32](_mostrar_progresso)
+        print("🧠 Criando e preenchendo o índice MCC no CLR...")
+    
+    resultado = indexador.BuildFromFolder(
+        os.path.abspath(pasta_templates), arquivo_indice_saida, *parametros,
+        paralelo, progresso, INTERVALO_PROGRESSO
+    )
+    
+    if verbose:
+        sys.stdout.write("\n")
+    
+    todos_arquivos = list(resultado.Arquivos)
+    templates_adicionados, erros = _erros_do_lote(resultado.Lote, todos_arquivos, verbose)
+    
+    return templates_adicionados, erros, todos_arquivos
+
+
+def _criar_em_python(pasta_templates, arquivo_indice_saida, parametros, verbose):
+    """
+    Indexa a pasta chamando o MccSdk arquivo a arquivo (sem o MccBatch.dll).
+    
+    Returns:
+        tuple: (templates_adicionados, lista_erros, nomes_por_id)
+    """
+    if verbose:
+        print("🧠 Criando índice MCC...")
+    
+    MccSdk.CreateMccIndex(*parametros)
+    
+    if verbose:
+        print("✅ Índice criado!\n")
+    
+    try:
+        # Obtém lista de arquivos .txt (nomes e caminhos absolutos)
+        entradas = _listar_templates(pasta_templates)
+        todos_arquivos = [e.name for e in entradas]
+        caminhos = [e.path for e in entradas]
+        
         if verbose:
-            print(f"\n💾 Salvando índice...")
+            print(f"📁 Processando {len(todos_arquivos)} arquivos...\n")
+        
+        templates_adicionados, erros = _adicionar_um_a_um(
+            caminhos, todos_arquivos, verbose
+        )
         
-        MccSdk.SaveMccIndexToFile(arquivo_indice_saida)
+        # Salva índice
+        if templates_adicionados > 0:
+            if verbose:
+                print(f"\n💾 Salvando índice...")
+            
+            MccSdk.SaveMccIndexToFile(arquivo_indice_saida)
+    finally:
+        # Limpa memória
+        MccSdk.DeleteMccIndex()
+    
+    return templates_adicionados, erros, todos_arquivos
+
+
+def criar_indice_mcc(pasta_templates, arquivo_indice_saida, verbose=True, paralelo=False):
+    """
+    Cria um índice MCC a partir de arquivos de template de minúcias.
+    
+    Com o MccBatch.dll, todo o pipeline roda numa única chamada ao CLR;
+    sem ele, os templates são adicionados um a um pelo Python.
+    
+    Args:
+        pasta_templates: Caminho da pasta contendo arquivos .txt com minúcias
+        arquivo_indice_saida: Caminho onde salvar o arquivo .idx
+        verbose: Se True, mostra progresso detalhado
+        paralelo: Se True, indexa em paralelo no CLR (requer MccBatch.dll e
+                  um MccSdk seguro para inserções concorrentes)
+    
+    Returns:
+        tuple: (num_sucessos, num_erros, lista_erros)
+    """
+    _ensure_sdk()
+    
+    # O SDK tem um único índice global: libera o índice aberto (em cache ou
+    # não) antes de criar/salvar
+    _fechar_indices_em_cache()
+    _fechar_indice_ativo()
+    
+    # Parâmetros do índice MCC
+    ns = 8              # número de setores
+    nd = 6              # número de direções
+    h = 24              # altura da célula
+    l = 32              # largura da célula
+    minNS = 30          # mínimo de células não vazias
+    minNP = 2           # mínimo de pares
+    deltaTheta = 3.14159 / 4.0  # tolerância angular
+    deltaXY = 256       # tolerância espacial
+    randomSeed = 17     # semente aleatória
+    parametros = (ns, nd, h, l, minNS, minNP, deltaTheta, deltaXY, randomSeed)
+    
+    indexador = _carregar_batch_indexer()
+    
+    if indexador is not None:
+        templates_adicionados, erros, todos_arquivos = _criar_no_clr(
+            indexador, pasta_templates, arquivo_indice_saida, parametros,
+            verbose, paralelo
+        )
+    else:
+        templates_adicionados, erros, todos_arquivos = _criar_em_python(
+            pasta_templates, arquivo_indice_saida, parametros, verbose
+        )
+    
+    if templates_adicionados > 0:
+        # Grava os nomes por ID (só os indexados) ao lado do índice: as
+        # buscas não precisam listar a pasta de novo
+        ids_falhos = {erro['id'] for erro in erros}
+        nomes_indexados = ['' if i in ids_falhos else nome
+                           for i, nome in enumerate(todos_arquivos)]
+        with open(_arquivo_nomes(arquivo_indice_saida), 'wb') as f:
+            f.write('\n'.join(nomes_indexados).encode('utf-8'))
         
         if verbose and os.path.exists(arquivo_indice_saida):
             tamanho = os.path.getsize(arquivo_indice_saida)
             print(f"✅ Índice salvo: {tamanho:,} bytes ({tamanho/1024:.1f} KB)")
             print(f"   📍 {arquivo_indice_saida}")
     
-    # Limpa memória
-    MccSdk.DeleteMccIndex()
-    
     return templates_adicionados, len(erros), erros
 
 
-def buscar_no_indice(arquivo_indice, arquivo_busca, max_candidatos=10):
+# MccIndex dono do índice global do SDK no momento (no máximo um)
+_INDICE_ATIVO = None
+
+
+def _fechar_indice_ativo():
+    """Libera o índice global do SDK, qualquer que seja o MccIndex dono."""
+    if _INDICE_ATIVO is not None:
+        _INDICE_ATIVO.close()
+
+
+atexit.register(_fechar_indice_ativo)
+
+
+class MccIndex:
     """
-    Busca um template no índice MCC (retorna IDs e scores).
+    Índice MCC carregado uma única vez e reutilizado por várias buscas.
     
-    Args:
-        arquivo_indice: Caminho do arquivo .idx
-        arquivo_busca: Caminho do arquivo .txt com minúcias para buscar
-        max_candidatos: Número máximo de candidatos a retornar
+    O MccSdk mantém um único índice global no processo: abrir um MccIndex
+    fecha o que estava ativo (as buscas nele passam a falhar), e só o dono
+    atual libera o índice do SDK. Como context manager, o índice é liberado
+    na saída:
     
-    Returns:
-        list: Lista de dicts {'id': int, 'score': float, 'rank': int}
-    """
+        with MccIndex(arquivo_indice, pasta_templates) as indice:
+            indice.buscar(arquivo_busca)
+            indice.buscar_com_politicas(arquivo_busca)
     
-    # Carrega índice
-    MccSdk.LoadMccIndexFromFile(arquivo_indice)
+    Para manter o índice aberto entre chamadas, use obter_indice().
+    """
     
-    try:
-        # Busca - retorna TUPLA (candidateList, sortedSimilarities)
-        resultado = MccSdk.SearchTextTemplateIntoMccIndex(
-            arquivo_busca,
-            False  # False = otimizado top-N
-        )
+    def __init__(self, arquivo_indice, pasta_templates=None):
+        """
+        Carrega o índice na memória.
         
-        # Desempacota a tupla
-        if isinstance(resultado, tuple) and len(resultado) == 2:
-            candidateList, sortedSimilarities = resultado
-        else:
-            candidateList = resultado
-            sortedSimilarities = None
+        Args:
+            arquivo_indice: Caminho do arquivo .idx
+            pasta_templates: Pasta com os templates originais (usada para os
+                             nomes quando não existe o <indice>.names)
+        """
+        self.arquivo_indice = arquivo_indice
+        self.pasta_templates = pasta_templates
+        self._nomes = None
         
-        # Se não encontrou candidatos
-        if candidateList is None or len(candidateList) == 0:
-            return []
+        global _INDICE_ATIVO
+        
+        _ensure_sdk()
+        
+        # Um índice por vez no SDK: o anterior deixa de ser válido
+        _fechar_indice_ativo()
+        
+        MccSdk.LoadMccIndexFromFile(arquivo_indice)
+        self._aberto = True
+        _INDICE_ATIVO = self
+        
+        # Nomes lidos junto com o índice: um .idx reconstruído (mtime novo)
+        # gera um novo MccIndex e, com ele, os nomes do novo <indice>.names
+        if os.path.exists(_arquivo_nomes(arquivo_indice)):
+            self._nomes = carregar_nomes(arquivo_indice, pasta_templates)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def __del__(self):
+        self.close()
+    
+    def close(self):
+        """
+        Libera o índice da memória (pode ser chamado mais de uma vez).
+        Só chama DeleteMccIndex se este MccIndex ainda for o dono do índice
+        global do SDK.
+        """
+        global _INDICE_ATIVO
+        if getattr(self, '_aberto', False):
+            self._aberto = False
+            if _INDICE_ATIVO is self:
+                _INDICE_ATIVO = None
+                try:
+                    MccSdk.DeleteMccIndex()
+                except:
+                    pass
+    
+    def nomes(self):
+        """
+        Lista template_id -> nome do arquivo deste índice (lida ao carregar,
+        ou listando a pasta de templates na primeira chamada).
+        """
+        if self._nomes is None:
+            self._nomes = carregar_nomes(self.arquivo_indice, self.pasta_templates)
+        return self._nomes
+    
+    def _buscar_bruto(self, arquivo_busca, max_candidatos):
+        """
+        Núcleo das buscas: uma chamada ao SDK no índice já carregado e cópia
+        em bloco dos top-N para NumPy.
         
-        # Converte para lista Python
-        resultados = []
-        for i in range(min(len(candidateList), max_candidatos)):
-            candidate_id = int(candidateList[i])
-            score = float(sortedSimilarities[i]) if sortedSimilarities is not None else None
+        Args:
+            arquivo_busca: Caminho do arquivo .txt com minúcias para buscar
+            max_candidatos: Número máximo de candidatos
+        
+        Returns:
+            tuple: (ids, scores) como arrays NumPy; scores é None quando o SDK
+                   não retorna similaridades. Arrays vazios se não houver
+                   candidatos ou em caso de erro.
+        """
+        try:
+            if not self._aberto:
+                raise RuntimeError("MccIndex fechado (outro índice foi carregado no SDK)")
             
-            resultado_item = {
-                'id': candidate_id,
-                'rank': i + 1
-            }
+            # Busca - retorna TUPLA (candidateList, sortedSimilarities)
+            resultado = MccSdk.SearchTextTemplateIntoMccIndex(
+                arquivo_busca,
+                False  # False = otimizado top-N
+            )
             
-            if score is not None:
-                resultado_item['score'] = score
+            # Desempacota a tupla
+            if isinstance(resultado, tuple) and len(resultado) == 2:
+                candidateList, sortedSimilarities = resultado
+            else:
+                candidateList = resultado
+                sortedSimilarities = None
             
-            resultados.append(resultado_item)
+            # Se não encontrou candidatos
+            if candidateList is None or len(candidateList) == 0:
+                return np.empty(0, dtype=np.int32), np.empty(0)
+            
+            # Copia em bloco para NumPy (uma chamada por array)
+            n = min(len(candidateList), max_candidatos)
+            ids = para_numpy(candidateList, n)
+            scores = para_numpy(sortedSimilarities, n) if sortedSimilarities is not None else None
+            
+            return ids, scores
+            
+        except Exception as e:
+            print(f"❌ Erro na busca: {e}")
+            import traceback
+            traceback.print_exc()
+            return np.empty(0, dtype=np.int32), np.empty(0)
+    
+    def _candidatos(self, ids, scores):
+        """Monta os dicts {'id', 'score', 'arquivo', 'rank'} a partir dos arrays."""
+        # Nomes dos arquivos por ID (carregados uma vez por índice)
+        arquivos = self.nomes()
         
-        return resultados
+        return [{
+            'id': candidate_id,
+            'score': score,
+            'arquivo': _nome_por_id(arquivos, candidate_id),
+            'rank': i + 1
+        } for i, (candidate_id, score) in enumerate(zip(ids.tolist(), scores.tolist()))]
+    
+    def buscar(self, arquivo_busca, max_candidatos=10):
+        """
+        Busca um template no índice MCC (retorna IDs e scores).
         
-    except Exception as e:
-        print(f"❌ Erro na busca: {e}")
-        import traceback
-        traceback.print_exc()
-        return []
+        Args:
+            arquivo_busca: Caminho do arquivo .txt com minúcias para buscar
+            max_candidatos: Número máximo de candidatos a retornar
+        
+        Returns:
+            list: Lista de dicts {'id': int, 'score': float, 'rank': int}
+        """
+        ids, scores = self._buscar_bruto(arquivo_busca, max_candidatos)
+        ids = ids.tolist()
+        
+        # Converte para lista Python (um laço para cada formato de retorno)
+        if scores is None:
+            return [{'id': ids[i], 'rank': i + 1} for i in range(len(ids))]
+        
+        scores = scores.tolist()
+        return [{'id': ids[i], 'score': scores[i], 'rank': i + 1} for i in range(len(ids))]
     
-    finally:
-        # Limpa índice da memória
-        try:
-            MccSdk.DeleteMccIndex()
-        except:
-            pass
+    def buscar_e_comparar(self, arquivo_busca, max_candidatos=5):
+        """
+        Busca no índice COM scores (usa os scores retornados pela busca).
+        
+        Args:
+            arquivo_busca: Template para buscar
+            max_candidatos: Top-N candidatos
+        
+        Returns:
+            list: Lista de dicts {'id': int, 'score': float, 'arquivo': str, 'rank': int}
+        """
+        ids, scores = self._buscar_bruto(arquivo_busca, max_candidatos)
+        
+        if scores is None:
+            print("❌ Formato de retorno inesperado")
+            return []
+        
+        return self._candidatos(ids, scores)
+    
+    def buscar_com_politicas(self, arquivo_busca,
+                             limiar_match=0.80,
+                             limiar_ambiguidade=0.10,
+                             max_candidatos=10,
+                             retornar_candidatos=False):
+        """
+        Busca com políticas de decisão configuráveis.
+        
+        Args:
+            arquivo_busca: Template para buscar
+            limiar_match: Score mínimo para considerar match
+            limiar_ambiguidade: Diferença mínima entre top-1 e top-2
+            max_candidatos: Número máximo de candidatos
+            retornar_candidatos: Se False, busca só o top-2 necessário para a
+                                 decisão e retorna apenas o top-1 em 'candidatos'
+        
+        Returns:
+            dict: Resultado com status, id, score, candidatos e mensagem
+        """
+        
+        # Uma única busca (a decisão só usa o top-1 e o top-2)
+        ids, scores = self._buscar_bruto(
+            arquivo_busca, max_candidatos if retornar_candidatos else 2
+        )
+        if scores is None:
+            ids, scores = ids[:0], np.empty(0)
+        
+        # Dicts só para os candidatos retornados
+        n_retorno = len(ids) if retornar_candidatos else 1
+        candidatos = self._candidatos(ids[:n_retorno], scores[:n_retorno])
+        
+        resultado = {
+            'status': None,
+            'id': None,
+            'score': None,
+            'candidatos': candidatos,
+            'mensagem': ''
+        }
+        
+        if len(candidatos) == 0:
+            resultado['status'] = 'NAO_ENCONTRADO'
+            resultado['mensagem'] = 'Nenhum candidato no índice'
+            return resultado
+        
+        # Top candidato
+        top = candidatos[0]
+        top_score = top['score']
+        
+        # Abaixo do limiar
+        if top_score < limiar_match:
+            resultado['status'] = 'ABAIXO_LIMIAR'
+            resultado['score'] = top_score
+            resultado['mensagem'] = f'Score {top_score:.3f} < limiar {limiar_match}'
+            return resultado
+        
+        # Verifica ambiguidade
+        if len(scores) > 1:
+            segundo_score = float(scores[1])
+            diferenca = top_score - segundo_score
+            
+            if diferenca < limiar_ambiguidade:
+                resultado['status'] = 'AMBIGUO'
+                resultado['mensagem'] = (f'Ambíguo: {top_score:.3f} vs '
+                                        f'{segundo_score:.3f} (diff={diferenca:.3f})')
+                return resultado
+        
+        # Match positivo
+        resultado['status'] = 'MATCH'
+        resultado['id'] = top['id']
+        resultado['score'] = top_score
+        resultado['mensagem'] = f'Match confirmado: score {top_score:.3f}'
+        
+        return resultado
+
+
+# Índice aberto reutilizado entre chamadas, por (caminho absoluto, mtime).
+# Guarda no máximo um: o MccSdk só mantém um índice por processo.
+_INDEX_CACHE = {}
+
+
+def _fechar_indices_em_cache():
+    """Fecha e esquece o índice em cache (se houver)."""
+    while _INDEX_CACHE:
+        _, indice = _INDEX_CACHE.popitem()
+        indice.close()
+
+
+atexit.register(_fechar_indices_em_cache)
+
+
+def obter_indice(arquivo_indice, pasta_templates=None):
+    """
+    Devolve o MccIndex em cache para o arquivo, carregando-o se preciso.
+    
+    O índice é recarregado quando o .idx muda (mtime diferente). Não feche o
+    índice devolvido: ele continua em cache para as próximas chamadas.
+    
+    Args:
+        arquivo_indice: Caminho do arquivo .idx
+        pasta_templates: Pasta com os templates originais (para os nomes)
+    
+    Returns:
+        MccIndex: Índice carregado
+    """
+    chave = (os.path.abspath(arquivo_indice), os.path.getmtime(arquivo_indice))
+    
+    indice = _INDEX_CACHE.get(chave)
+    if indice is None or not indice._aberto:
+        _fechar_indices_em_cache()
+        indice = MccIndex(arquivo_indice, pasta_templates)
+        _INDEX_CACHE[chave] = indice
+    elif indice.pasta_templates is None:
+        indice.pasta_templates = pasta_templates
+    
+    return indice
+
+
+def buscar_no_indice(arquivo_indice, arquivo_busca, max_candidatos=10):
+    """
+    Busca um template no índice MCC (retorna IDs e scores).
+    Reutiliza o índice em cache (ver obter_indice).
+    
+    Args:
+        arquivo_indice: Caminho do arquivo .idx
+        arquivo_busca: Caminho do arquivo .txt com minúcias para buscar
+        max_candidatos: Número máximo de candidatos a retornar
+    
+    Returns:
+        list: Lista de dicts {'id': int, 'score': float, 'rank': int}
+    """
+    return obter_indice(arquivo_indice).buscar(arquivo_busca, max_candidatos)
 
 
 def buscar_e_comparar(arquivo_indice, arquivo_busca, pasta_templates, max_candidatos=5):
     """
     Busca no índice COM scores (usa os scores retornados pela busca).
+    Reutiliza o índice em cache (ver obter_indice).
     
     Args:
         arquivo_indice: Caminho do .idx
@@ -175,69 +681,18 @@ def buscar_e_comparar(arquivo_indice, arquivo_busca, pasta_templates, max_candid
     Returns:
         list: Lista de dicts {'id': int, 'score': float, 'arquivo': str, 'rank': int}
     """
-    
-    # Carrega índice
-    MccSdk.LoadMccIndexFromFile(arquivo_indice)
-    
-    try:
-        # Busca - retorna TUPLA (candidateList, sortedSimilarities)
-        resultado = MccSdk.SearchTextTemplateIntoMccIndex(
-            arquivo_busca,
-            False  # False = otimizado top-N
-        )
-        
-        # Desempacota a tupla
-        if isinstance(resultado, tuple) and len(resultado) == 2:
-            candidateList, sortedSimilarities = resultado
-        else:
-            print("❌ Formato de retorno inesperado")
-            return []
-        
-        # Se não encontrou candidatos
-        if candidateList is None or len(candidateList) == 0:
-            return []
-        
-        # Obtém lista de arquivos (mesma ordem usada na indexação)
-        arquivos = sorted([f for f in os.listdir(pasta_templates) if f.lower().endswith('.txt')])
-        
-        # Monta resultados com scores
-        resultados = []
-        for i in range(min(len(candidateList), max_candidatos)):
-            candidate_id = int(candidateList[i])
-            score = float(sortedSimilarities[i])
-            
-            # Obtém nome do arquivo
-            arquivo_nome = arquivos[candidate_id] if candidate_id < len(arquivos) else f"ID_{candidate_id}"
-            
-            resultados.append({
-                'id': candidate_id,
-                'score': score,
-                'arquivo': arquivo_nome,
-                'rank': i + 1
-            })
-        
-        return resultados
-        
-    except Exception as e:
-        print(f"❌ Erro na busca: {e}")
-        import traceback
-        traceback.print_exc()
-        return []
-    
-    finally:
-        # Limpa índice da memória
-        try:
-            MccSdk.DeleteMccIndex()
-        except:
-            pass
+    indice = obter_indice(arquivo_indice, pasta_templates)
+    return indice.buscar_e_comparar(arquivo_busca, max_candidatos)
 
 
 def buscar_com_politicas(arquivo_indice, arquivo_busca, pasta_templates,
                          limiar_match=0.80,
                          limiar_ambiguidade=0.10,
-                         max_candidatos=10):
+                         max_candidatos=10,
+                         retornar_candidatos=False):
     """
     Busca com políticas de decisão configuráveis.
+    Reutiliza o índice em cache (ver obter_indice).
     
     Args:
         arquivo_indice: Caminho do .idx
@@ -246,56 +701,16 @@ def buscar_com_politicas(arquivo_indice, arquivo_busca, pasta_templates,
         limiar_match: Score mínimo para considerar match
         limiar_ambiguidade: Diferença mínima entre top-1 e top-2
         max_candidatos: Número máximo de candidatos
+        retornar_candidatos: Se False, retorna apenas o top-1 em 'candidatos'
     
     Returns:
         dict: Resultado com status, id, score, candidatos e mensagem
     """
-    
-    # Busca com scores
-    candidatos = buscar_e_comparar(arquivo_indice, arquivo_busca, pasta_templates, max_candidatos)
-    
-    resultado = {
-        'status': None,
-        'id': None,
-        'score': None,
-        'candidatos': candidatos,
-        'mensagem': ''
-    }
-    
-    if len(candidatos) == 0:
-        resultado['status'] = 'NAO_ENCONTRADO'
-        resultado['mensagem'] = 'Nenhum candidato no índice'
-        return resultado
-    
-    # Top candidato
-    top = candidatos[0]
-    top_score = top['score']
-    
-    # Abaixo do limiar
-    if top_score < limiar_match:
-        resultado['status'] = 'ABAIXO_LIMIAR'
-        resultado['score'] = top_score
-        resultado['mensagem'] = f'Score {top_score:.3f} < limiar {limiar_match}'
-        return resultado
-    
-    # Verifica ambiguidade
-    if len(candidatos) > 1:
-        segundo_score = candidatos[1]['score']
-        diferenca = top_score - segundo_score
-        
-        if diferenca < limiar_ambiguidade:
-            resultado['status'] = 'AMBIGUO'
-            resultado['mensagem'] = (f'Ambíguo: {top_score:.3f} vs '
-                                    f'{segundo_score:.3f} (diff={diferenca:.3f})')
-            return resultado
-    
-    # Match positivo
-    resultado['status'] = 'MATCH'
-    resultado['id'] = top['id']
-    resultado['score'] = top_score
-    resultado['mensagem'] = f'Match confirmado: score {top_score:.3f}'
-    
-    return resultado
+    indice = obter_indice(arquivo_indice, pasta_templates)
+    return indice.buscar_com_politicas(
+        arquivo_busca, limiar_match, limiar_ambiguidade, max_candidatos,
+        retornar_candidatos
+    )
 
 
 # ============================================================================
@@ -351,73 +766,75 @@ if __name__ == "__main__":
         
         if os.path.exists(arquivo_teste):
             
-            # --------------------------------------------------------------
-            # EXEMPLO 1: Busca rápida (IDs e scores)
-            # --------------------------------------------------------------
-            print("🔍 EXEMPLO 1: Busca rápida (IDs e scores)")
-            print(f"   Buscando: {os.path.basename(arquivo_teste)}\n")
-            
-            candidatos_rapidos = buscar_no_indice(arquivo_idx, arquivo_teste, max_candidatos=5)
-            
-            if candidatos_rapidos:
-                print(f"   Top {len(candidatos_rapidos)} candidatos:")
-                for c in candidatos_rapidos:
-                    if 'score' in c:
-                        print(f"      #{c['rank']}: ID {c['id']:3d} | Score: {c['score']:.4f}")
-                    else:
-                        print(f"      #{c['rank']}: ID {c['id']:3d}")
-            else:
-                print("   ❌ Nenhum candidato encontrado")
-            
-            print()
-            
-            # --------------------------------------------------------------
-            # EXEMPLO 2: Busca com nomes de arquivos
-            # --------------------------------------------------------------
-            print("🔍 EXEMPLO 2: Busca com nomes de arquivos")
-            print(f"   Buscando: {os.path.basename(arquivo_teste)}\n")
-            
-            resultados_scores = buscar_e_comparar(arquivo_idx, arquivo_teste, pasta_templates, max_candidatos=5)
-            
-            if resultados_scores:
-                print(f"   Top {len(resultados_scores)} candidatos:")
-                for r in resultados_scores:
-                    print(f"      #{r['rank']}: ID {r['id']:3d} | Score: {r['score']:.4f} | {r['arquivo']}")
-            else:
-                print("   ❌ Nenhum candidato encontrado")
-            
-            print()
-            
-            # --------------------------------------------------------------
-            # EXEMPLO 3: Busca com políticas de decisão
-            # --------------------------------------------------------------
-            print("🔍 EXEMPLO 3: Busca com políticas de decisão")
-            print(f"   Buscando: {os.path.basename(arquivo_teste)}")
-            print(f"   Limiar de match: 0.80")
-            print(f"   Limiar de ambiguidade: 0.10\n")
-            
-            resultado = buscar_com_politicas(
-                arquivo_idx, 
-                arquivo_teste, 
-                pasta_templates,
-                limiar_match=0.80,
-                limiar_ambiguidade=0.10,
-                max_candidatos=10
-            )
-            
-            print(f"   📊 Resultado:")
-            print(f"      Status: {resultado['status']}")
-            print(f"      Mensagem: {resultado['mensagem']}")
-            
-            if resultado['status'] == 'MATCH':
-                print(f"      ✅ ID identificado: {resultado['id']}")
-                print(f"      Score: {resultado['score']:.4f}")
-            elif resultado['status'] == 'AMBIGUO':
-                print(f"      ⚠️ Top candidatos ambíguos:")
-                for i, c in enumerate(resultado['candidatos'][:3], 1):
-                    print(f"         {i}. ID {c['id']} - Score: {c['score']:.4f}")
-            
-            print()
+            # Um único carregamento do índice para os três exemplos
+            with MccIndex(arquivo_idx, pasta_templates) as indice:
+                
+                # --------------------------------------------------------------
+                # EXEMPLO 1: Busca rápida (IDs e scores)
+                # --------------------------------------------------------------
+                print("🔍 EXEMPLO 1: Busca rápida (IDs e scores)")
+                print(f"   Buscando: {os.path.basename(arquivo_teste)}\n")
+                
+                candidatos_rapidos = indice.buscar(arquivo_teste, max_candidatos=5)
+                
+                if candidatos_rapidos:
+                    print(f"   Top {len(candidatos_rapidos)} candidatos:")
+                    for c in candidatos_rapidos:
+                        if 'score' in c:
+                            print(f"      #{c['rank']}: ID {c['id']:3d} | Score: {c['score']:.4f}")
+                        else:
+                            print(f"      #{c['rank']}: ID {c['id']:3d}")
+                else:
+                    print("   ❌ Nenhum candidato encontrado")
+                
+                print()
+                
+                # --------------------------------------------------------------
+                # EXEMPLO 2: Busca com nomes de arquivos
+                # --------------------------------------------------------------
+                print("🔍 EXEMPLO 2: Busca com nomes de arquivos")
+                print(f"   Buscando: {os.path.basename(arquivo_teste)}\n")
+                
+                resultados_scores = indice.buscar_e_comparar(arquivo_teste, max_candidatos=5)
+                
+                if resultados_scores:
+                    print(f"   Top {len(resultados_scores)} candidatos:")
+                    for r in resultados_scores:
+                        print(f"      #{r['rank']}: ID {r['id']:3d} | Score: {r['score']:.4f} | {r['arquivo']}")
+                else:
+                    print("   ❌ Nenhum candidato encontrado")
+                
+                print()
+                
+                # --------------------------------------------------------------
+                # EXEMPLO 3: Busca com políticas de decisão
+                # --------------------------------------------------------------
+                print("🔍 EXEMPLO 3: Busca com políticas de decisão")
+                print(f"   Buscando: {os.path.basename(arquivo_teste)}")
+                print(f"   Limiar de match: 0.80")
+                print(f"   Limiar de ambiguidade: 0.10\n")
+                
+                resultado = indice.buscar_com_politicas(
+                    arquivo_teste,
+                    limiar_match=0.80,
+                    limiar_ambiguidade=0.10,
+                    max_candidatos=10,
+                    retornar_candidatos=True  # lista os ambíguos abaixo
+                )
+                
+                print(f"   📊 Resultado:")
+                print(f"      Status: {resultado['status']}")
+                print(f"      Mensagem: {resultado['mensagem']}")
+                
+                if resultado['status'] == 'MATCH':
+                    print(f"      ✅ ID identificado: {resultado['id']}")
+                    print(f"      Score: {resultado['score']:.4f}")
+                elif resultado['status'] == 'AMBIGUO':
+                    print(f"      ⚠️ Top candidatos ambíguos:")
+                    for i, c in enumerate(resultado['candidatos'][:3], 1):
+                        print(f"         {i}. ID {c['id']} - Score: {c['score']:.4f}")
+                
+                print()
         else:
             print(f"⚠️ Arquivo de teste não encontrado: {arquivo_teste}")
     